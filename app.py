@@ -2,17 +2,21 @@
 # It's good practice to handle the case where a database query returns None in your routes. This can happen if an ID does not exist in the database. You can use get_or_404 to simplify this process.
 
 import os
+from functools import lru_cache
 
-from flask import Flask, render_template, request, flash, redirect, session, g
+from flask import Flask, render_template, request, flash, redirect, session, g, abort
 from flask_wtf import FlaskForm
-from flask_bcrypt import Bcrypt
 from flask_debugtoolbar import DebugToolbarExtension
+from jinja2 import FileSystemBytecodeCache
+from sqlalchemy import delete, exists, insert, lambda_stmt, literal, select
 from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import joinedload, load_only, selectinload
 
 from forms import UserAddForm, LoginForm, MessageForm, UserEditForm
-from models import db, connect_db, User, Message, Likes
+from models import db, connect_db, User, Message, Likes, Follows
 
 CURR_USER_KEY = "curr_user"
+USERS_PAGE_SIZE = 50
 
 app = Flask(__name__)
 
@@ -23,27 +27,80 @@ app.app_context().push()
 app.config['SQLALCHEMY_DATABASE_URI'] = (
     os.environ.get('DATABASE_URL', 'postgresql:///warbler'))
 
+# Size the connection pool for a threaded worker; pre-ping and recycle so
+# connections dropped by the server (or a pooler) aren't handed out stale.
+if app.config['SQLALCHEMY_DATABASE_URI'].startswith('postgresql'):
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = {
+        'pool_size': int(os.environ.get('DB_POOL_SIZE', 10)),
+        'max_overflow': int(os.environ.get('DB_MAX_OVERFLOW', 20)),
+        'pool_pre_ping': os.environ.get('DB_POOL_PRE_PING', '1') == '1',
+        'pool_recycle': 1800,
+    }
+
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 app.config['SQLALCHEMY_ECHO'] = False
 app.config['DEBUG_TB_INTERCEPT_REDIRECTS'] = True
 app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY', "it's a secret")
+app.config['BCRYPT_LOG_ROUNDS'] = int(os.environ.get('BCRYPT_COST', 10))
 # toolbar = DebugToolbarExtension(app)
 
-connect_db(app)
+# Keep compiled templates on disk so restarted workers skip parsing them.
+# Templates are only re-checked for changes in debug mode (Flask's default
+# for TEMPLATES_AUTO_RELOAD).
+app.jinja_env.bytecode_cache = FileSystemBytecodeCache(
+    os.environ.get('JINJA_CACHE_DIR'))
 
-bcrypt = Bcrypt()
+connect_db(app)
 
 
 ##############################################################################
 # User signup/login/logout
 
 
+class LazyUser:
+    """Stand-in for the logged-in user that only loads the row when needed.
+
+    Routes that just check `g.user` or read `g.user.id` never touch the
+    database; any other attribute access loads the User and delegates to it.
+    """
+
+    def __init__(self, user_id):
+        object.__setattr__(self, 'id', user_id)
+        object.__setattr__(self, '_user', None)
+
+    def load(self):
+        """Return the underlying User, fetching it on first use."""
+
+        if self._user is None:
+            # Eager-load `following` so the homepage feed and the templates'
+            # is_following checks don't each trigger a lazy SELECT.
+            user = db.session.get(User, self.id,
+                                  options=[selectinload(User.following)])
+
+            if user is None:
+                # account was deleted out from under this session; treat it
+                # like any other request without a logged-in user
+                do_logout()
+                flash("Access unauthorized.", "danger")
+                abort(redirect("/"))
+
+            object.__setattr__(self, '_user', user)
+
+        return self._user
+
+    def __getattr__(self, name):
+        return getattr(self.load(), name)
+
+    def __setattr__(self, name, value):
+        setattr(self.load(), name, value)
+
+
 @app.before_request
 def add_user_to_g():
     """If we're logged in, add current user to Flask global."""
 
     if CURR_USER_KEY in session:
-        g.user = User.query.get(session[CURR_USER_KEY])
+        g.user = LazyUser(session[CURR_USER_KEY])
 
     else:
         g.user = None
@@ -133,13 +190,35 @@ def logout():
 ##############################################################################
 # Community route:
 
+def paginate_users(query):
+    """Return one page of users from `query`, keyed on user id.
+
+    Reads the `after` cursor from the querystring. Returns (users, next_after),
+    where next_after is the cursor for the following page, or None if this
+    is the last page.
+    """
+
+    after = request.args.get('after', 0, type=int)
+    # only fetch the columns the user cards display
+    users = (query
+             .options(load_only(User.id, User.username, User.image_url,
+                                User.header_image_url, User.bio))
+             .filter(User.id > after)
+             .order_by(User.id)
+             .limit(USERS_PAGE_SIZE)
+             .all())
+    next_after = users[-1].id if len(users) == USERS_PAGE_SIZE else None
+
+    return users, next_after
+
+
 @app.route('/community')
 def community():
     """Show communities page with listing of all users."""
 
-    users = User.query.all()
+    users, next_after = paginate_users(db.session.query(User))
 
-    return render_template('users/index.html', users=users)
+    return render_template('users/index.html', users=users, next_after=next_after)
 
 ##############################################################################
 # General user routes:
@@ -154,30 +233,42 @@ def list_users():
     search = request.args.get('q')
 
     if not search:
-        users = User.query.all()
+        query = db.session.query(User)
     else:
-        users = User.query.filter(User.username.like(f"%{search}%")).all()
+        # autoescape makes % and _ in the search match literally
+        query = db.session.query(User).filter(
+            User.username.icontains(search, autoescape=True))
+
+    users, next_after = paginate_users(query)
 
-    return render_template('users/index.html', users=users)
+    return render_template('users/index.html', users=users, next_after=next_after)
 
 
 @app.route('/users/<int:user_id>')
 def users_show(user_id):
     """Show user profile."""
 
-    user = User.query.get_or_404(user_id)
+    user = db.get_or_404(User, user_id)
 
     # snagging messages in order from the database;
     # user.messages won't be in order by default
-    messages = (Message
-                .query
-                .filter(Message.user_id == user_id)
-                .order_by(Message.timestamp.desc())
-                .limit(100)
-                .all())
+    messages = db.session.scalars(
+        select(Message)
+        .filter(Message.user_id == user_id)
+        .order_by(Message.timestamp.desc())
+        .limit(100)).all()
     return render_template('users/show.html', user=user, messages=messages)
 
 
+def get_user_with_follows_or_404(user_id):
+    """Get a user with both follow lists loaded up front, or 404."""
+
+    return db.one_or_404(
+        select(User)
+        .filter_by(id=user_id)
+        .options(selectinload(User.following), selectinload(User.followers)))
+
+
 @app.route('/users/<int:user_id>/following')
 def show_following(user_id):
     """Show list of people this user is following."""
@@ -186,8 +277,10 @@ def show_following(user_id):
         flash("Access unauthorized. Please log in.", "danger")
         return redirect("/")
 
-    user = User.query.get_or_404(user_id)
-    return render_template('users/following.html', user=user)
+    user = get_user_with_follows_or_404(user_id)
+    my_following_ids = {u.id for u in g.user.following}
+    return render_template('users/following.html', user=user,
+                           my_following_ids=my_following_ids)
 
 
 @app.route('/users/<int:user_id>/followers')
@@ -198,8 +291,10 @@ def users_followers(user_id):
         flash("Access unauthorized. Please log in.", "danger")
         return redirect("/")
 
-    user = User.query.get_or_404(user_id)
-    return render_template('users/followers.html', user=user)
+    user = get_user_with_follows_or_404(user_id)
+    my_following_ids = {u.id for u in g.user.following}
+    return render_template('users/followers.html', user=user,
+                           my_following_ids=my_following_ids)
 
 
 @app.route('/users/follow/<int:follow_id>', methods=['POST'])
@@ -210,9 +305,16 @@ def add_follow(follow_id):
         flash("Access unauthorized.", "danger")
         return redirect("/")
 
-    followed_user = User.query.get_or_404(follow_id)
-    g.user.following.append(followed_user)
-    db.session.commit()
+    # write the follows row directly; the foreign key and primary key
+    # constraints reject unknown users and duplicate follows
+    try:
+        db.session.execute(
+            insert(Follows).values(user_being_followed_id=follow_id,
+                                   user_following_id=g.user.id))
+        db.session.commit()
+    except IntegrityError:
+        db.session.rollback()
+        flash("Unable to follow that user.", "danger")
 
     return redirect(f"/users/{g.user.id}/following")
 
@@ -225,8 +327,10 @@ def stop_following(follow_id):
         flash("Access unauthorized.", "danger")
         return redirect("/")
 
-    followed_user = User.query.get(follow_id)
-    g.user.following.remove(followed_user)
+    db.session.execute(
+        delete(Follows)
+        .where(Follows.user_being_followed_id == follow_id,
+               Follows.user_following_id == g.user.id))
     db.session.commit()
 
     return redirect(f"/users/{g.user.id}/following")
@@ -275,7 +379,7 @@ def delete_user():
 
     do_logout()
 
-    db.session.delete(g.user)
+    db.session.delete(g.user.load())
     db.session.commit()
 
     return redirect("/signup")
@@ -311,7 +415,9 @@ def messages_add():
 def messages_show(message_id):
     """Show a message."""
 
-    msg = Message.query.get(message_id)
+    # the page only shows the author's name and avatar
+    msg = db.session.get(Message, message_id, options=[
+        joinedload(Message.user).load_only(User.id, User.username, User.image_url)])
     return render_template('messages/show.html', message=msg)
 
 
@@ -323,10 +429,18 @@ def messages_destroy(message_id):
         flash("Access unauthorized.", "danger")
         return redirect("/")
 
-    msg = Message.query.get(message_id)
-    db.session.delete(msg)
+    # check the author in the DELETE itself: g.user.id comes straight from
+    # the session, so it may belong to a deleted account
+    deleted = db.session.execute(
+        delete(Message)
+        .where(Message.id == message_id, Message.user_id == g.user.id)
+        .returning(Message.id)).first()
     db.session.commit()
 
+    if not deleted:
+        flash("Access unauthorized.", "danger")
+        return redirect("/")
+
     return redirect(f"/users/{g.user.id}")
 
 
@@ -342,22 +456,39 @@ def homepage():
     - logged in: 100 most recent messages of followed_users
     """
     if g.user:
-        followed_users_ids = [user.id for user in g.user.following]
-        messages = (Message
-                    .query
-                    .filter(Message.user_id.in_(followed_users_ids))
-                    .order_by(Message.timestamp.desc())
-                    .limit(100)
-                    .all())
-        liked_messages = Likes.query.filter_by(user_id=g.user.id).with_entities(Likes.message_id).all()
-        liked_message_ids = [int(row[0]) for row in liked_messages]
-        for liked_msg_id in liked_message_ids:
-            print(type(liked_msg_id))
+        # join through follows so the feed is one query instead of
+        # loading the followed ids first; lambda_stmt caches the compiled
+        # SQL, so only user_id is bound per request
+        user_id = g.user.id
+        messages = db.session.scalars(lambda_stmt(
+            lambda: select(Message)
+            .join(Follows, Follows.user_being_followed_id == Message.user_id)
+            .where(Follows.user_following_id == user_id)
+            .order_by(Message.timestamp.desc())
+            .limit(100))).all()
+        # a set, since the template does a membership test per message;
+        # an empty feed has nothing to mark as liked
+        liked_message_ids = frozenset()
+        if messages:
+            liked_message_ids = frozenset(db.session.scalars(
+                select(Likes.message_id).where(Likes.user_id == user_id)))
 
         return render_template('home.html', messages=messages, liked_message=liked_message_ids)
-    else:
+
+    # pending flash messages have to be rendered into the page, so only
+    # the plain landing page can come from the cache
+    if '_flashes' in session:
         return render_template('home-anon.html')
 
+    return anon_homepage()
+
+
+@lru_cache(maxsize=None)
+def anon_homepage():
+    """Render the anonymous homepage once; it's the same for every visitor."""
+
+    return render_template('home-anon.html')
+
 
 
 ##############################################################################
@@ -367,44 +498,73 @@ def homepage():
 #
 # https://stackoverflow.com/questions/34066804/disabling-caching-in-flask
 
+NO_CACHE_HEADERS = {
+    "Cache-Control": "no-cache, no-store, must-revalidate",
+    "Pragma": "no-cache",
+    "Expires": "0",
+}
+
+
 @app.after_request
 def add_header(req):
     """Add non-caching headers on every request."""
 
-    req.headers["Cache-Control"] = "no-cache, no-store, must-revalidate"
-    req.headers["Pragma"] = "no-cache"
-    req.headers["Expires"] = "0"
-    req.headers['Cache-Control'] = 'public, max-age=0'
+    req.headers.update(NO_CACHE_HEADERS)
     return req
 
 ##############################################################################
 # Like routes
 
+def delete_like(user_id, message_id):
+    """Build a DELETE of this user's like on this message, returning its id."""
+
+    return (delete(Likes)
+            .where(Likes.user_id == user_id, Likes.message_id == message_id)
+            .returning(Likes.id))
+
+
+def toggle_like(user_id, message_id):
+    """Like the message if the user hasn't already, otherwise unlike it.
+
+    Done as one statement (a DELETE in a CTE, then an INSERT only if it
+    deleted nothing), so the check and the write can't interleave with
+    another request. Returns True if the message is now liked.
+    """
+
+    unliked = delete_like(user_id, message_id).cte('unliked')
+    liked = db.session.execute(
+        insert(Likes)
+        .add_cte(unliked)
+        .from_select(['user_id', 'message_id'],
+                     select(literal(user_id), literal(message_id))
+                     .where(~exists(select(unliked.c.id))))
+        .returning(Likes.id)).first()
+    db.session.commit()
+
+    return liked is not None
+
+
 @app.route('/users/add_like/<int:message_id>', methods=['POST'])
 def add_like(message_id):
     """Add or remove a like for the currently logged-in user to a message."""
-    
+
     if not g.user:
         flash("Access unauthorized.", "danger")
         return redirect("/login")
-    
-    message = Message.query.get_or_404(message_id)
-    
-    # Check if the user has already liked the message
-    like = Likes.query.filter_by(user_id=g.user.id, message_id=message_id).first()
-    
-    if like:
-        # If the user has already liked the message, remove the like
-        db.session.delete(like)
-        db.session.commit()
-        flash("You've unliked the message.", "warning")
-    else:
-        # If the user has not liked the message, add a new like
-        new_like = Likes(user_id=g.user.id, message_id=message_id)
-        db.session.add(new_like)
-        db.session.commit()
+
+    try:
+        liked = toggle_like(g.user.id, message_id)
+    except IntegrityError:
+        # message doesn't exist, or a concurrent request liked it first
+        db.session.rollback()
+        flash("Unable to like that message.", "danger")
+        return redirect("/")
+
+    if liked:
         flash("You've liked the message.", "success")
-    
+    else:
+        flash("You've unliked the message.", "warning")
+
     return redirect("/")
 
 
@@ -416,18 +576,13 @@ def remove_like(message_id):
         flash("Access unauthorized.", "danger")
         return redirect("/login")
 
-    message = Message.query.get_or_404(message_id)
+    unliked = db.session.execute(delete_like(g.user.id, message_id)).first()
+    db.session.commit()
 
-    # Check if the user has liked the warble
-    like = Likes.query.filter_by(user_id=g.user.id, message_id=message_id).first()
-    if not like:
+    if not unliked:
         flash("You haven't liked this warble yet.", "warning")
         return redirect(f"/users/{g.user.id}/likes")  # Redirect to the current user's likes page
 
-    # Remove the like
-    db.session.delete(like)
-    db.session.commit()
-
     flash("Warble unliked.", "success")
     return redirect(f"/users/{g.user.id}/likes")  # Redirect to the current user's likes page
 
@@ -440,7 +595,7 @@ def show_likes(user_id):
         flash("Access unauthorized.", "danger")
         return redirect("/login")
 
-    user = User.query.get_or_404(user_id)
+    user = db.get_or_404(User, user_id)
 
     # Get the messages liked by the user
     liked_messages = user.likes
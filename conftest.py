@@ -0,0 +1,37 @@
+"""pytest configuration.
+
+When the suite runs under pytest-xdist (`pytest -n auto --dist loadscope`),
+each worker gets its own schema in the test database, so workers can create,
+drop and fill tables without stepping on each other.
+"""
+
+import os
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+WORKER = os.environ.get('PYTEST_XDIST_WORKER')
+
+
+if WORKER:
+    @event.listens_for(Engine, 'connect')
+    def use_worker_schema(dbapi_connection, connection_record):
+        """Point each new connection at this worker's schema."""
+
+        cursor = dbapi_connection.cursor()
+        # pg_trgm is shared by every worker, so install it once, in a schema
+        # of its own; the advisory lock keeps workers from racing to create it
+        cursor.execute("SELECT pg_advisory_xact_lock(hashtext('warbler-tests'))")
+        cursor.execute("CREATE SCHEMA IF NOT EXISTS extensions")
+        cursor.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm SCHEMA extensions")
+        # it may already be installed somewhere else, so ask where it is
+        cursor.execute("SELECT extnamespace::regnamespace FROM pg_extension "
+                       "WHERE extname = 'pg_trgm'")
+        trgm_schema = cursor.fetchone()[0]
+        cursor.execute(f'CREATE SCHEMA IF NOT EXISTS "{WORKER}"')
+        # the worker's schema, plus pg_trgm's for gin_trgm_ops; public stays
+        # off the path, so drop_all/create_all never touch tables a serial
+        # run left there
+        cursor.execute(f'SET search_path TO "{WORKER}", {trgm_schema}')
+        cursor.close()
+        dbapi_connection.commit()
@@ -0,0 +1,73 @@
+"""Shared base test case for the Warbler test suites.
+
+Import this before the app: it sets the environment the app reads when
+it's imported.
+"""
+
+import os
+from unittest import TestCase
+
+from sqlalchemy.orm import scoped_session, sessionmaker
+
+# Always replace DATABASE_URL, which may name a real database: setUpClass
+# drops every table. TEST_DATABASE_URL picks a different test database.
+os.environ['DATABASE_URL'] = os.environ.get(
+    'TEST_DATABASE_URL', "postgresql:///warbler-test")
+
+# Hash passwords at bcrypt's minimum cost so fixtures are cheap to create
+os.environ['BCRYPT_COST'] = "4"
+
+# Tests use one connection at a time against a local server, so keep the
+# pool small and skip the liveness ping on every checkout
+os.environ['DB_POOL_SIZE'] = "1"
+os.environ['DB_POOL_PRE_PING'] = "0"
+
+from app import app
+from models import db
+
+
+class DBTestCase(TestCase):
+    """Test case that rolls back everything each test writes.
+
+    The tables and test client are created once per class. Each test runs
+    on a connection whose transaction is rolled back in tearDown; commits in
+    the test (or in the views it calls) only release a SAVEPOINT.
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        """Create the tables and test client once for all tests."""
+
+        # Drop all tables to ensure a clean state
+        db.drop_all()
+        # Recreate all tables
+        db.create_all()
+
+        cls.client = app.test_client()
+
+    def setUp(self):
+        """Start a transaction for this test."""
+
+        # The client is shared, so drop any login left by the last test
+        self.client.cookie_jar.clear()
+
+        # Nothing else writes to this connection, so there's no need to
+        # expire (and re-SELECT) objects after each commit.
+        #
+        # app.py pushes an app context at import, so requests reuse it and
+        # Flask-SQLAlchemy's teardown (session.remove) doesn't swap this
+        # session out between a request and the test's assertions.
+        self.connection = db.engine.connect()
+        self.trans = self.connection.begin()
+        self.app_session = db.session
+        db.session = scoped_session(sessionmaker(
+            bind=self.connection, join_transaction_mode="create_savepoint",
+            expire_on_commit=False))
+
+    def tearDown(self):
+        """Roll back everything the test wrote."""
+
+        db.session.remove()
+        db.session = self.app_session
+        self.trans.rollback()
+        self.connection.close()
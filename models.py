@@ -4,8 +4,10 @@
 
 from datetime import datetime, timezone
 
-from flask_bcrypt import Bcrypt, check_password_hash
+from bcrypt import checkpw
+from flask_bcrypt import Bcrypt
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import DDL, event, lambda_stmt, select
 
 bcrypt = Bcrypt()
 db = SQLAlchemy()
@@ -46,11 +48,18 @@ class Likes(db.Model):
 
     message_id = db.Column(
         db.Integer,
-        db.ForeignKey('messages.id', ondelete='cascade'),
-        unique=True
+        db.ForeignKey('messages.id', ondelete='cascade')
     )
 
     message = db.relationship('Message', backref='likes', overlaps="likes")
+
+    # one like per user per message; the unique index also serves the
+    # (user, message) lookup in the like toggle, the other one serves
+    # lookups by message
+    __table_args__ = (
+        db.UniqueConstraint('user_id', 'message_id', name='uq_likes_user_message'),
+        db.Index('ix_likes_message_user', 'message_id', 'user_id'),
+    )
     
 
 class User(db.Model):
@@ -99,6 +108,17 @@ class User(db.Model):
         nullable=False
     )
 
+    # trigram index so substring searches on username can use an index
+    # instead of a sequential scan (needs the pg_trgm extension, below)
+    __table_args__ = (
+        db.Index(
+            'users_username_trgm',
+            'username',
+            postgresql_using='gin',
+            postgresql_ops={'username': 'gin_trgm_ops'},
+        ),
+    )
+
     messages = db.relationship('Message', back_populates='user')
 
     followers = db.relationship(
@@ -137,7 +157,7 @@ class User(db.Model):
         return other_user in self.following
     
     def check_password(self, password):
-        return check_password_hash(self.password, password)
+        return checkpw(password.encode('UTF-8'), self.password.encode('UTF-8'))
 
     @classmethod
     def signup(cls, username, email, password, image_url):
@@ -172,14 +192,24 @@ class User(db.Model):
         If can't find matching user (or if password is wrong), returns False.
         """
 
-        user = cls.query.filter_by(username=username).first()
+        # lambda_stmt caches the compiled SQL; only username is bound per call
+        user = db.session.execute(lambda_stmt(
+            lambda: select(User).where(User.username == username)
+        )).scalar_one_or_none()
 
-        if user and bcrypt.check_password_hash(user.password, password):
+        if user and user.check_password(password):
             return user
 
         return False
 
 
+event.listen(
+    User.__table__,
+    'before_create',
+    DDL('CREATE EXTENSION IF NOT EXISTS pg_trgm').execute_if(dialect='postgresql'),
+)
+
+
 class Message(db.Model):
     """An individual message ("warble")."""
 
@@ -209,6 +239,12 @@ class Message(db.Model):
 
     user = db.relationship('User', back_populates='messages')
 
+    # serves both the user page and the homepage feed: filter by author,
+    # newest first
+    __table_args__ = (
+        db.Index('ix_messages_user_ts', 'user_id', timestamp.desc()),
+    )
+
     # likes = db.relationship(
     #     'Likes',
     #     backref='message',
@@ -225,3 +261,4 @@ def connect_db(app):
 
     db.app = app
     db.init_app(app)
+    bcrypt.init_app(app)
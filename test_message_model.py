@@ -6,30 +6,18 @@
 #
 #    python -m unittest test_message_model.py
 
-import os
 from datetime import datetime
-from unittest import TestCase
 from models import db, User, Message, Likes
 
-os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+from db_test_case import DBTestCase
 
-from app import app
-
-class MessageModelTestCase(TestCase):
+class MessageModelTestCase(DBTestCase):
     """Test functions related to Message model."""
 
     def setUp(self):
-        """Create test client, add sample data."""
-
-        # Drop all tables to ensure a clean state
-        db.drop_all()
-        # Recreate all tables
-        db.create_all()
+        """Start a transaction for this test, add sample data."""
 
-        User.query.delete()
-        Message.query.delete()
-
-        self.client = app.test_client()
+        super().setUp()
 
         user = User.signup("testuser", "test@test.com", "password", None)
         db.session.add(user)
@@ -37,10 +25,6 @@ class MessageModelTestCase(TestCase):
 
         self.user = user
 
-    def tearDown(self):
-        """Clean up fouled transactions."""
-        db.session.rollback()
-
     def test_text_attribute(self):
         """Does the text attribute store the message content correctly?"""
         message = Message(text="Test message", user_id=self.user.id)
@@ -64,7 +48,7 @@ class MessageModelTestCase(TestCase):
 
     def test_likes_relationship(self):
         """Does the likes relationship correctly associate the message with its likes?"""
-        user = User.query.get(1)
+        user = self.user
         message = Message(
             text="Test message",
             timestamp=datetime.utcnow(),
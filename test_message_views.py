@@ -7,21 +7,9 @@
 #    FLASK_ENV=production python -m unittest test_message_views.py
 
 
-import os
-from unittest import TestCase
-
-from models import db, connect_db, Message, User
-
-# BEFORE we import our app, let's set an environmental variable
-# to use a different database for tests (we need to do this
-# before we import our app, since that will have already
-# connected to the database
-
-os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
-
-
-# Now we can import app
+from models import db, connect_db, Message, User, Likes
 
+from db_test_case import DBTestCase
 from app import app, CURR_USER_KEY
 
 # Create our tables (we do this here, so we only create the tables
@@ -35,18 +23,13 @@ from app import app, CURR_USER_KEY
 app.config['WTF_CSRF_ENABLED'] = False
 
 
-class MessageViewTestCase(TestCase):
+class MessageViewTestCase(DBTestCase):
     """Test views for messages."""
 
     def setUp(self):
-        """Create test client, add sample data."""
-        db.drop_all()
-        db.create_all()
-
-        User.query.delete()
-        Message.query.delete()
+        """Start a transaction for this test, add sample data."""
 
-        self.client = app.test_client()
+        super().setUp()
 
         self.testuser = User.signup(username="testuser",
                                     email="test@test.com",
@@ -55,10 +38,6 @@ class MessageViewTestCase(TestCase):
 
         db.session.commit()
 
-    def tearDown(self):
-        """Clean up any fouled transactions."""
-        db.session.rollback()
-
     def test_add_message(self):
         """Can use add a message?"""
 
@@ -144,4 +123,64 @@ class MessageViewTestCase(TestCase):
             response = client.post(f"/messages/{msg.id}/delete", follow_redirects=True)
 
             # Check if the response at the redirected URL contains the "Access unauthorized" message
-            self.assertIn(b"Access unauthorized", response.data)
\ No newline at end of file
+            self.assertIn(b"Access unauthorized", response.data)
+
+    def test_toggle_like(self):
+        """Does posting to add_like like a message, then unlike it?"""
+        msg = Message(text="Test message", user_id=self.testuser.id)
+        db.session.add(msg)
+        db.session.commit()
+        msg_id = msg.id
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.testuser.id
+
+            resp = c.post(f"/users/add_like/{msg_id}")
+            self.assertEqual(resp.status_code, 302)
+            self.assertEqual(Likes.query.filter_by(message_id=msg_id).count(), 1)
+
+            resp = c.post(f"/users/add_like/{msg_id}")
+            self.assertEqual(resp.status_code, 302)
+            self.assertEqual(Likes.query.filter_by(message_id=msg_id).count(), 0)
+
+    def test_delete_other_users_message(self):
+        """Test prohibiting deleting a message written by someone else."""
+        other = User.signup("otheruser", "other@test.com", "password", None)
+        db.session.commit()
+
+        msg = Message(text="Test message", user_id=self.testuser.id)
+        db.session.add(msg)
+        db.session.commit()
+        msg_id = msg.id
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = other.id
+
+            resp = c.post(f"/messages/{msg_id}/delete", follow_redirects=True)
+            self.assertIn(b"Access unauthorized", resp.data)
+            self.assertIsNotNone(Message.query.get(msg_id))
+
+    def test_deleted_account_session(self):
+        """Test treating a session for a deleted account as logged out."""
+        msg = Message(text="Test message", user_id=self.testuser.id)
+        db.session.add(msg)
+        db.session.commit()
+        msg_id = msg.id
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = 99999999  # no such user
+
+            resp = c.post(f"/messages/{msg_id}/delete", follow_redirects=True)
+            self.assertIn(b"Access unauthorized", resp.data)
+            self.assertIsNotNone(Message.query.get(msg_id))
+
+            # adding a message loads the user, which logs the session out
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = 99999999
+
+            resp = c.post("/messages/new", data={"text": "Hello"}, follow_redirects=True)
+            self.assertIn(b"Access unauthorized", resp.data)
+            self.assertEqual(Message.query.filter_by(text="Hello").count(), 0)
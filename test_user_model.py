@@ -7,81 +7,88 @@
 #    python -m unittest test_user_model.py
 
 
-import os
-from unittest import TestCase
+from sqlalchemy import insert, text
 
-from models import db, User, Message, Likes
+from models import db, bcrypt, User
 
-# BEFORE we import our app, let's set an environmental variable
-# to use a different database for tests (we need to do this
-# before we import our app, since that will have already
-# connected to the database
+from db_test_case import DBTestCase
 
-os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+# Create our tables (we do this here, so we only create the tables
+# once for all tests --- in each test, we'll delete the data
+# and create fresh new clean test data
 
+# Hash of "password", computed once and stored directly on sample users so
+# only the tests that exercise User.signup pay for hashing
+PASSWORD_HASH = bcrypt.generate_password_hash("password").decode('UTF-8')
 
-# Now we can import app
 
-from app import app
+def seed_users(*names):
+    """Insert a user per name, bypassing User.signup; return their ids."""
 
-# Create our tables (we do this here, so we only create the tables
-# once for all tests --- in each test, we'll delete the data
-# and create fresh new clean test data
+    rows = [dict(username=name, email=f"{name}@test.com", password=PASSWORD_HASH)
+            for name in names]
+    ids = db.session.scalars(
+        insert(User).returning(User.id, sort_by_parameter_order=True),
+        rows).all()
+    db.session.commit()
+
+    return ids
 
 
-class UserModelTestCase(TestCase):
+class UserModelTestCase(DBTestCase):
     """Test views for messages."""
 
-    def setUp(self):
-        """Create test client, add sample data."""
-        
-        # Drop all tables to ensure a clean state
-        db.drop_all()
-        # Recreate all tables
-        db.create_all()
+    @classmethod
+    def setUpClass(cls):
+        """Create the tables, test client and sample users once for all tests."""
 
-        User.query.delete()
-        Message.query.delete()
-        Likes.query.delete()
+        super().setUpClass()
 
-        self.client = app.test_client()
+        # Sample users are committed once for the class; each test's
+        # changes to them are rolled back in tearDown.
+        cls.user1_id, cls.user2_id = seed_users("testuser1", "testuser2")
+        db.session.remove()
 
-        user1 = User.signup("testuser1", "test1@test.com", "password", None)
-        user2 = User.signup("testuser2", "test2@test.com", "password", None)
+    @classmethod
+    def tearDownClass(cls):
+        """Remove the sample users committed in setUpClass."""
 
+        db.session.execute(text(
+            "TRUNCATE users, messages, likes, follows RESTART IDENTITY CASCADE"))
         db.session.commit()
+        db.session.remove()
+
+    def setUp(self):
+        """Start a transaction for this test, load sample data."""
 
-        self.user1 = user1
-        self.user2 = user2
+        super().setUp()
 
-    def tearDown(self):
-        """Clean up fouled transactions."""
-        db.session.rollback()
+        self.user1 = db.session.get(User, self.user1_id)
+        self.user2 = db.session.get(User, self.user2_id)
 
     def test_repr(self):
         """Does the repr method work as expected?"""
-        self.assertEqual(repr(self.user1), "<User #1: testuser1, test1@test.com>")
+        self.assertEqual(repr(self.user1), f"<User #{self.user1.id}: testuser1, testuser1@test.com>")
 
     def test_is_following(self):
-        """Does is_following successfully detect when user1 is following user2?"""
+        """Does is_following detect whether user1 is following user2?"""
+        self.assertFalse(self.user1.is_following(self.user2))
+
         self.user1.following.append(self.user2)
         db.session.commit()
         self.assertTrue(self.user1.is_following(self.user2))
 
-    def test_is_not_following(self):
-        """Does is_following successfully detect when user1 is not following user2?"""
-        self.assertFalse(self.user1.is_following(self.user2))
-
     def test_is_followed_by(self):
-        """Does is_followed_by successfully detect when user1 is followed by user2?"""
+        """Does is_followed_by detect whether user1 is followed by user2?"""
+        self.assertFalse(self.user1.is_followed_by(self.user2))
+
         self.user2.following.append(self.user1)
         db.session.commit()
+        # objects aren't expired on commit, so reload the followers
+        # loaded by the first assertion
+        db.session.expire(self.user1, ['followers'])
         self.assertTrue(self.user1.is_followed_by(self.user2))
 
-    def test_is_not_followed_by(self):
-        """Does is_followed_by successfully detect when user1 is not followed by user2?"""
-        self.assertFalse(self.user1.is_followed_by(self.user2))
-
     def test_signup(self):
         """Does User-create successfully create a new user given valid credentials?"""
         new_user = User.signup("newuser", "newuser@test.com", "password", None)
@@ -94,17 +101,14 @@ class UserModelTestCase(TestCase):
             User.signup(None, "test@test.com", "password", None)
             db.session.commit()
 
-    def test_authenticate_valid(self):
-        """Does User.authenticate successfully return a user when given valid credentials?"""
-        user = User.authenticate("testuser1", "password")
-        self.assertEqual(user, self.user1)
-
-    def test_authenticate_invalid_username(self):
-        """Does User.authenticate fail to return a user when the username is invalid?"""
-        user = User.authenticate("invalidusername", "password")
-        self.assertFalse(user)
-
-    def test_authenticate_invalid_password(self):
-        """Does User.authenticate fail to return a user when the password is invalid?"""
-        user = User.authenticate("testuser1", "invalidpassword")
-        self.assertFalse(user)
\ No newline at end of file
+    def test_authenticate(self):
+        """Does User.authenticate return the user only for valid credentials?"""
+        cases = [
+            ("testuser1", "password", self.user1),
+            ("invalidusername", "password", False),
+            ("testuser1", "invalidpassword", False),
+        ]
+
+        for username, password, expected in cases:
+            with self.subTest(username=username, password=password):
+                self.assertEqual(User.authenticate(username, password), expected)
@@ -6,11 +6,10 @@
 #
 #    python -m unittest test_user_views.py
 
-from unittest import TestCase
-from app import app, db, User, Message, CURR_USER_KEY  # Import CURR_USER_KEY from app.py
+from sqlalchemy import event
 
-# Make sure to use a different database for testing
-app.config['SQLALCHEMY_DATABASE_URI'] = "postgresql:///warbler-tet"
+from db_test_case import DBTestCase
+from app import app, db, User, Message, Follows, CURR_USER_KEY, USERS_PAGE_SIZE  # Import CURR_USER_KEY from app.py
 
 # Disable CSRF protection in Flask-WTF forms during testing
 app.config['WTF_CSRF_ENABLED'] = False
@@ -18,48 +17,95 @@ app.config['WTF_CSRF_ENABLED'] = False
 # Make Flask errors real errors instead of HTML pages with error info
 app.config['TESTING'] = True
 
-class UserViewsTestCase(TestCase):
+class UserViewsTestCase(DBTestCase):
     """Test views for user-related routes."""
 
     def setUp(self):
-        """Clean up any existing user data and create a test client."""
-        db.drop_all()
-        db.create_all()
+        """Start a transaction for this test, add sample data."""
+
+        super().setUp()
 
         # Create a test user
         self.user = User.signup("testuser", "test@test.com", "password", None)
-        db.session.add(self.user)
         db.session.commit()
 
-        self.client = app.test_client()
+    def count_queries(self, func):
+        """Return how many SQL statements calling `func` runs."""
+
+        statements = []
+
+        def record(conn, cursor, statement, *args):
+            statements.append(statement)
+
+        # start from a clean identity map, as a new request would
+        db.session.expire_all()
+
+        event.listen(db.engine, 'before_cursor_execute', record)
+        try:
+            func()
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', record)
 
-    def tearDown(self):
-        """Clean up any fouled transactions."""
-        db.session.rollback()
+        return len(statements)
 
     def test_signup(self):
         """Test user signup."""
         with self.client as c:
             # Send a POST request to the signup route
-            response = c.post('/signup', data={"username": "newuser", "email": "new@test.com", "password": "newpassword"}, follow_redirects=True)
-            self.assertEqual(response.status_code, 200)
-            # Check if the user is redirected to the homepage after signup
-            self.assertIn(b"Welcome to Warbler", response.data)
+            response = c.post('/signup', data={"username": "newuser", "email": "new@test.com", "password": "newpassword"})
+            # Check if the user is logged in and redirected to the homepage after signup
+            self.assertEqual(response.status_code, 302)
+            self.assertEqual(response.location, "/")
+            with c.session_transaction() as sess:
+                self.assertIn(CURR_USER_KEY, sess)
+                self.assertIn(("success", "Welcome to Warbler"), sess["_flashes"])
 
     def test_login(self):
         """Test user login."""
         with self.client as c:
             # Send a POST request to the login route
-            response = c.post('/login', data={"username": "testuser", "password": "password"}, follow_redirects=True)
+            response = c.post('/login', data={"username": "testuser", "password": "password"})
+            # Check if the user is logged in and redirected to the homepage after login
+            self.assertEqual(response.status_code, 302)
+            self.assertEqual(response.location, "/")
+            with c.session_transaction() as sess:
+                self.assertEqual(sess[CURR_USER_KEY], self.user.id)
+                self.assertIn(("success", "Hello, testuser!"), sess["_flashes"])
+
+    def test_users_pagination(self):
+        """Test that the user list is paged, and the Next link keeps the search."""
+        # One full page of matching users plus a few more; nobody logs in as
+        # them, so the password doesn't need hashing
+        db.session.add_all([
+            User(username=f"pageuser{i}", email=f"page{i}@test.com", password="password")
+            for i in range(USERS_PAGE_SIZE + 3)])
+        db.session.commit()
+
+        page_ids = sorted(user.id for user in User.query.filter(User.username.startswith("pageuser")))
+        last_id = page_ids[USERS_PAGE_SIZE - 1]
+
+        with self.client as c:
+            # The first page stops at USERS_PAGE_SIZE users
+            response = c.get('/users?q=pageuser')
+            html = response.get_data(as_text=True)
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(html.count("<p>@pageuser"), USERS_PAGE_SIZE)
+            # Next picks up after the last user shown and keeps the search
+            self.assertIn(f"/users?q=pageuser&amp;after={last_id}", html)
+
+            # The next page has the rest, and no further Next link
+            response = c.get(f'/users?q=pageuser&after={last_id}')
+            html = response.get_data(as_text=True)
             self.assertEqual(response.status_code, 200)
-            # Check if the user is redirected to the homepage after login
-            self.assertIn(b"Hello, testuser!", response.data)
+            self.assertEqual(html.count("<p>@pageuser"), 3)
+            self.assertNotIn("after=", html)
 
     def test_following_page_logged_in(self):
         """Test accessing the following page when logged in."""
         with self.client as c:
             # Log in as the test user
-            c.post('/login', data={"username": "testuser", "password": "password"}, follow_redirects=True)
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.user.id
             # Access the following page of the test user
             response = c.get(f'/users/{self.user.id}/following')
             # Check if the response status code is 200
@@ -69,11 +115,11 @@ class UserViewsTestCase(TestCase):
         """Test accessing the followers page of another user when logged in."""
         with self.client as c:
             # Log in as the test user
-            c.post('/login', data={"username": "testuser", "password": "password"}, follow_redirects=True)
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.user.id
             
             # Create another user for testing
             other_user = User.signup("otheruser", "other@test.com", "password", None)
-            db.session.add(other_user)
             db.session.commit()
 
             # Access the followers page of the other user
@@ -86,16 +132,94 @@ class UserViewsTestCase(TestCase):
         """Test disallowing access to the following page when logged out."""
         with self.client as c:
             # Access the following page of the test user without logging in
-            response = c.get(f'/users/{self.user.id}/following', follow_redirects=True)
+            response = c.get(f'/users/{self.user.id}/following')
             # Check if the user is redirected to the home page
-            self.assertIn(b"Access unauthorized", response.data)
-            self.assertNotIn(b"Login", response.data)
+            self.assertEqual(response.status_code, 302)
+            self.assertEqual(response.location, "/")
+            with c.session_transaction() as sess:
+                self.assertIn(("danger", "Access unauthorized. Please log in."), sess["_flashes"])
 
     def test_follower_page_logged_out(self):
         """Test disallowing access to the follower page when logged out."""
         with self.client as c:
             # Access the follower page of the test user without logging in
-            response = c.get(f'/users/{self.user.id}/followers', follow_redirects=True)
+            response = c.get(f'/users/{self.user.id}/followers')
             # Check if the user is redirected to the home page
-            self.assertIn(b"Access unauthorized", response.data)
-            self.assertNotIn(b"Login", response.data)
\ No newline at end of file
+            self.assertEqual(response.status_code, 302)
+            self.assertEqual(response.location, "/")
+            with c.session_transaction() as sess:
+                self.assertIn(("danger", "Access unauthorized. Please log in."), sess["_flashes"])
+
+    def test_follow_and_unfollow(self):
+        """Test following and then unfollowing another user."""
+        other_user = User.signup("otheruser", "other@test.com", "password", None)
+        db.session.commit()
+        other_id = other_user.id
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.user.id
+
+            response = c.post(f'/users/follow/{other_id}')
+            self.assertEqual(response.status_code, 302)
+            self.assertEqual(Follows.query.filter_by(user_following_id=self.user.id,
+                                                     user_being_followed_id=other_id).count(), 1)
+
+            response = c.post(f'/users/stop-following/{other_id}')
+            self.assertEqual(response.status_code, 302)
+            self.assertEqual(Follows.query.filter_by(user_following_id=self.user.id,
+                                                     user_being_followed_id=other_id).count(), 0)
+
+    def test_search_escapes_wildcards(self):
+        """Test that LIKE wildcards in a search match literally."""
+        User.signup("other_user", "other@test.com", "password", None)
+        db.session.commit()
+
+        with self.client as c:
+            response = c.get('/users?q=%')
+            self.assertIn(b"Sorry, no users found", response.data)
+
+            response = c.get('/users?q=_')
+            self.assertIn(b"@other_user", response.data)
+            self.assertNotIn(b"@testuser", response.data)
+
+    def test_follow_pages_query_count(self):
+        """Test that the follow pages don't run a query per listed user."""
+        users = [User.signup(f"user{i}", f"user{i}@test.com", "password", None)
+                 for i in range(3)]
+        db.session.commit()
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.user.id
+
+            for page in ['following', 'followers']:
+                def get_page():
+                    response = c.get(f'/users/{self.user.id}/{page}')
+                    self.assertEqual(response.status_code, 200)
+
+                self.user.following = users[:1]
+                self.user.followers = users[:1]
+                db.session.commit()
+                with_one = self.count_queries(get_page)
+
+                self.user.following = users
+                self.user.followers = users
+                db.session.commit()
+                with_three = self.count_queries(get_page)
+
+                self.assertEqual(with_one, with_three, page)
+
+    def test_session_survives_requests(self):
+        """Test that requests don't remove the test's session."""
+        session = db.session()
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.user.id
+
+            c.get(f'/users/{self.user.id}')
+            c.get('/')
+
+        self.assertIs(db.session(), session)
+        self.assertIn(self.user, db.session)